@@ -0,0 +1,114 @@
+"""Pytest configuration shared by the test suite."""
+
+import collections
+import copy
+import os
+
+import gymnasium as gym
+import mujoco
+import pytest
+
+import gymnasium_robotics  # noqa: F401
+from tests.utils import non_mujoco_py_env_ids
+
+# The version 3 maze environments all write their generated model to the same temporary
+# xml file, therefore, they have to run in the same worker to avoid reading a partial file.
+_SHARED_XDIST_GROUPS = {
+    "gymnasium_robotics.envs.maze.ant_maze_v3:AntMazeEnv": "AntMaze-v3",
+}
+
+# The environments whose tests take several times longer than the others' (see `--durations`)
+SLOW_ENV_IDS = {"FrankaKitchen-v1"}
+
+
+def _env_xdist_group(env_id: str) -> str:
+    """Returns the `pytest-xdist` group name for the tests of an environment."""
+    return _SHARED_XDIST_GROUPS.get(gym.spec(env_id).entry_point, env_id)
+
+
+def pytest_addoption(parser):
+    """Adds the `--run-slow` option to run the tests marked as slow."""
+    parser.addoption(
+        "--run-slow",
+        action="store_true",
+        default=False,
+        help="run the tests marked as slow",
+    )
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(config, items):
+    """Skips the slow tests and groups the tests using `shared_env` by the environment id.
+
+    The tests marked as slow are skipped unless `--run-slow` is given.
+    With `--dist=loadgroup`, this runs all the tests of an environment in the same worker
+    while the different environments are distributed across the workers.
+    The hook has to run before the one of `pytest-xdist`, which adds the groups to the node ids.
+    """
+    skip_slow = pytest.mark.skip(reason="slow test, use --run-slow to run it")
+    for item in items:
+        if "slow" in item.keywords and not config.getoption("--run-slow"):
+            item.add_marker(skip_slow)
+
+        callspec = getattr(item, "callspec", None)
+        if callspec is None:
+            continue
+
+        if "shared_env" in callspec.params:
+            env_id = callspec.params["shared_env"]
+            item.add_marker(pytest.mark.xdist_group(_env_xdist_group(env_id)))
+
+
+@pytest.fixture(
+    scope="session",
+    params=[
+        (
+            pytest.param(env_id, marks=pytest.mark.slow)
+            if env_id in SLOW_ENV_IDS
+            else env_id
+        )
+        for env_id in non_mujoco_py_env_ids
+    ],
+)
+def shared_env(request) -> gym.Env:
+    """An environment shared by all the tests of an environment id.
+
+    This avoids parsing and compiling the MuJoCo model of the environment in every test.
+    Tests using the environment must reset it with a seed before relying on its state.
+    """
+    env = gym.make(request.param, disable_env_checker=True)
+    env.reset()
+    yield env
+    env.close()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _cache_mujoco_models():
+    """Parses and compiles each MuJoCo model xml file once per test session.
+
+    The models are cached by the directory and the content of the xml file, as the maze
+    environments write their generated models to temporary files. Environments get a copy
+    of the cached model as some of them modify their model, i.e. the offscreen rendering size.
+    As the tests of an environment run together, only the recent models are kept.
+    """
+    from_xml_path = mujoco.MjModel.from_xml_path
+    models = collections.OrderedDict()
+
+    def _cached_from_xml_path(filename, assets=None):
+        if assets is not None:
+            return from_xml_path(filename, assets)
+
+        with open(filename, "rb") as f:
+            key = (os.path.dirname(os.path.abspath(filename)), f.read())
+        if key not in models:
+            models[key] = from_xml_path(filename)
+            if len(models) > 16:
+                models.popitem(last=False)
+        models.move_to_end(key)
+        return copy.copy(models[key])
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(
+            mujoco.MjModel, "from_xml_path", staticmethod(_cached_from_xml_path)
+        )
+        yield
@@ -2,19 +2,20 @@ import pickle
 import warnings
 
 import gymnasium as gym
+import mujoco
 import numpy as np
 import pytest
-from gymnasium.envs.mujoco.utils import check_mujoco_reset_state
-from gymnasium.envs.registration import EnvSpec
+from gymnasium.envs.mujoco.utils import check_mujoco_reset_state, get_state, set_state
 from gymnasium.error import Error
-from gymnasium.utils.env_checker import check_env, data_equivalence
+from gymnasium.utils.env_checker import check_env
+from gymnasium.vector.utils import concatenate, create_empty_array
 
 import gymnasium_robotics
-from tests.utils import all_testing_env_specs, assert_equals
+from tests.utils import assert_equals, non_mujoco_py_env_ids
 
 gym.register_envs(gymnasium_robotics)
 
-CHECK_ENV_IGNORE_WARNINGS = [
+CHECK_ENV_IGNORE_WARNINGS = frozenset(
     f"\x1b[33mWARN: {message}\x1b[0m"
     for message in [
         "This version of the mujoco environments depends on the mujoco-py bindings, which are no longer maintained and may stop working. Please upgrade to the v4 versions of the environments (which depend on the mujoco python bindings instead), unless you are trying to precisely replicate previous works.",
@@ -23,31 +24,17 @@ CHECK_ENV_IGNORE_WARNINGS = [
         "A Box observation space maximum value is infinity. This is probably too high.",
         "For Box action spaces, we recommend using a symmetric and normalized space (range=[-1, 1] or [0, 1]). See https://stable-baselines3.readthedocs.io/en/master/guide/rl_tips.html for more information.",
     ]
-]
-
-# Exclude mujoco_py environments in test_render_modes test due to OpenGL error.
-non_mujoco_py_env_specs = [
-    spec
-    for spec in all_testing_env_specs
-    if "MujocoPy" not in spec.entry_point
-    and not spec.entry_point.startswith(
-        "gymnasium_robotics.envs.mujoco."
-    )  # Exclude version 2 and version 3 of the "mujoco" environments
-]
+)
 
 
-@pytest.mark.parametrize(
-    "spec", non_mujoco_py_env_specs, ids=[spec.id for spec in non_mujoco_py_env_specs]
-)
-def test_env(spec):
+def test_env(shared_env: gym.Env):
     # Capture warnings
-    env = spec.make(disable_env_checker=True).unwrapped
+    env = shared_env.unwrapped
 
     warnings.simplefilter("always")
-    # Test if env adheres to Gym API
+    # Test if env adheres to Gym API, closing the environment is checked by `test_render_modes`
     with warnings.catch_warnings(record=True) as w:
-        check_env(env, skip_render_check=True)
-        env.close()
+        check_env(env, skip_render_check=True, skip_close_check=True)
     for warning in w:
         if warning.message.args[0] not in CHECK_ENV_IGNORE_WARNINGS:
             raise Error(f"Unexpected warning: {warning.message}")
@@ -59,68 +46,98 @@ SEED = 0
 NUM_STEPS = 50
 
 
-@pytest.mark.parametrize(
-    "env_spec", non_mujoco_py_env_specs, ids=[env.id for env in non_mujoco_py_env_specs]
-)
-def test_env_determinism_rollout(env_spec: EnvSpec):
-    """Run a rollout with two environments and assert equality.
-
-    This test run a rollout of NUM_STEPS steps with two environments
-    initialized with the same seed and assert that:
+def _record_rollout(env: gym.Env, actions: np.ndarray):
+    """Steps `env` with `actions` and returns the batched observations, rewards, terminations, truncations and infos."""
+    observations, infos = [], []
+    rewards = np.empty(len(actions))
+    terminations = np.empty(len(actions), dtype=bool)
+    truncations = np.empty(len(actions), dtype=bool)
+    for time_step, action in enumerate(actions):
+        obs, rewards[time_step], terminated, truncated, info = env.step(action)
+        assert env.observation_space.contains(obs)
+
+        observations.append(obs)
+        terminations[time_step], truncations[time_step] = terminated, truncated
+        infos.append(info)
+
+        if terminated or truncated:
+            env.reset(seed=SEED)
+
+    observations = concatenate(
+        env.observation_space,
+        observations,
+        create_empty_array(env.observation_space, len(actions), fn=np.empty),
+    )
+    return observations, rewards, terminations, truncations, tuple(infos)
+
+
+def _first_differing_step(batch_1, batch_2):
+    """Returns the first step at which the stacked observations differ, or `None`."""
+    if isinstance(batch_1, dict) and isinstance(batch_2, dict):
+        steps = [
+            _first_differing_step(batch_1[key], batch_2[key])
+            for key in batch_1.keys() & batch_2.keys()
+        ]
+        return min((step for step in steps if step is not None), default=None)
+    elif isinstance(batch_1, np.ndarray) and isinstance(batch_2, np.ndarray):
+        if batch_1.shape != batch_2.shape or batch_1.ndim == 0:
+            return None
+        differs = (batch_1 != batch_2).reshape(len(batch_1), -1).any(axis=1)
+        steps = np.flatnonzero(differs)
+        return int(steps[0]) if len(steps) > 0 else None
+    return None
+
+
+def test_env_determinism_rollout(shared_env: gym.Env):
+    """Run a rollout twice from the same initial state and assert equality.
+
+    This test run a rollout of NUM_STEPS steps with an environment reset with a seed,
+    then restores the MuJoCo state from before the reset and replays the rollout
+    with the same seed and actions, and assert that:
 
     - observation after first reset are the same
-    - same actions are sampled by the two envs
     - observations are contained in the observation space
-    - obs, rew, terminated, truncated and info are equals between the two envs
+    - obs, rew, terminated, truncated and info are equals between the two rollouts
+
+    The MuJoCo state is restored before the second reset as the reset of some environments
+    (i.e. the Shadow Dexterous Hand manipulate environments) depends on the previous steps.
     """
     # Don't check rollout equality if it's a nondeterministic environment.
-    if env_spec.nondeterministic is True:
+    if shared_env.spec.nondeterministic is True:
         return
 
-    env_1 = env_spec.make(disable_env_checker=True)
-    env_2 = env_spec.make(disable_env_checker=True)
-
-    initial_obs_1 = env_1.reset(seed=SEED)
-    initial_obs_2 = env_2.reset(seed=SEED)
-    assert_equals(initial_obs_1, initial_obs_2)
-
-    env_1.action_space.seed(SEED)
-
-    for time_step in range(NUM_STEPS):
-        # We don't evaluate the determinism of actions
-        action = env_1.action_space.sample()
-
-        obs_1, rew_1, terminated_1, truncated_1, info_1 = env_1.step(action)
-        obs_2, rew_2, terminated_2, truncated_2, info_2 = env_2.step(action)
-
-        assert_equals(obs_1, obs_2, f"[{time_step}] ")
-        assert env_1.observation_space.contains(
-            obs_1
-        )  # obs_2 verified by previous assertion
-
-        assert rew_1 == rew_2, f"[{time_step}] reward 1={rew_1}, reward 2={rew_2}"
-        assert (
-            terminated_1 == terminated_2
-        ), f"[{time_step}] terminated 1={terminated_1}, terminated 2={terminated_2}"
-        assert (
-            truncated_1 == truncated_2
-        ), f"[{time_step}] truncated 1={truncated_1}, truncated 2={truncated_2}"
-        assert_equals(info_1, info_2, f"[{time_step}] ")
-
-        if (
-            terminated_1 or truncated_1
-        ):  # terminated_2 and truncated_2 verified by previous assertion
-            env_1.reset(seed=SEED)
-            env_2.reset(seed=SEED)
+    shared_env.action_space.seed(SEED)
+    # We don't evaluate the determinism of actions
+    actions = np.stack([shared_env.action_space.sample() for _ in range(NUM_STEPS)])
 
-    env_1.close()
-    env_2.close()
+    initial_state = get_state(shared_env, mujoco.mjtState.mjSTATE_INTEGRATION)
+    initial_obs_1 = shared_env.reset(seed=SEED)
+    obs_1, rew_1, terminated_1, truncated_1, info_1 = _record_rollout(
+        shared_env, actions
+    )
 
-
-@pytest.mark.parametrize(
-    "env_spec", non_mujoco_py_env_specs, ids=[env.id for env in non_mujoco_py_env_specs]
-)
-def test_mujoco_reset_state_seeding(env_spec: EnvSpec):
+    set_state(shared_env, initial_state, mujoco.mjtState.mjSTATE_INTEGRATION)
+    initial_obs_2 = shared_env.reset(seed=SEED)
+    assert_equals(initial_obs_1, initial_obs_2)
+    obs_2, rew_2, terminated_2, truncated_2, info_2 = _record_rollout(
+        shared_env, actions
+    )
+
+    step = _first_differing_step(obs_1, obs_2)
+    assert_equals(obs_1, obs_2, None if step is None else f"[{step}] ")
+    assert np.array_equal(rew_1, rew_2), f"reward 1={rew_1}, reward 2={rew_2}"
+    assert np.array_equal(
+        terminated_1, terminated_2
+    ), f"terminated 1={terminated_1}, terminated 2={terminated_2}"
+    assert np.array_equal(
+        truncated_1, truncated_2
+    ), f"truncated 1={truncated_1}, truncated 2={truncated_2}"
+    assert len(info_1) == len(info_2), f"info 1={info_1}, info 2={info_2}"
+    for time_step, (step_info_1, step_info_2) in enumerate(zip(info_1, info_2)):
+        assert_equals(step_info_1, step_info_2, f"[{time_step}] ")
+
+
+def test_mujoco_reset_state_seeding(shared_env: gym.Env):
     """Check if the reset method of mujoco environments is deterministic for the same seed.
 
     Note:
@@ -130,65 +147,93 @@ def test_mujoco_reset_state_seeding(env_spec: EnvSpec):
         This will not be fixed and tests are expected to fail.
     """
     # Don't check rollout equality if it's a nondeterministic environment.
-    if env_spec.nondeterministic is True:
+    if shared_env.spec.nondeterministic is True:
         return
 
-    env = env_spec.make(disable_env_checker=True)
-
-    check_mujoco_reset_state(env)
+    check_mujoco_reset_state(shared_env)
 
 
-@pytest.mark.parametrize(
-    "spec", non_mujoco_py_env_specs, ids=[spec.id for spec in non_mujoco_py_env_specs]
-)
-def test_render_modes(spec):
-    env = spec.make()
+def test_render_modes(shared_env: gym.Env):
+    # The render modes are read from the shared environment, only the rendering environments are made
+    render_modes = [
+        mode for mode in shared_env.metadata.get("render_modes", []) if mode != "human"
+    ]
 
-    for mode in env.metadata.get("render_modes", []):
-        if mode != "human":
-            new_env = spec.make(render_mode=mode)
+    for mode in render_modes:
+        new_env = gym.make(shared_env.spec.id, render_mode=mode)
 
-            new_env.reset()
-            new_env.step(new_env.action_space.sample())
-            new_env.render()
+        new_env.reset()
+        new_env.step(new_env.action_space.sample())
+        new_env.render()
 
-            new_env.close
+        # Closing an environment twice should be allowed
+        new_env.close()
+        new_env.close()
 
 
-@pytest.mark.parametrize(
-    "env_spec",
-    non_mujoco_py_env_specs,
-    ids=[spec.id for spec in non_mujoco_py_env_specs],
-)
-def test_pickle_env(env_spec):
-    env: gym.Env = env_spec.make()
+def test_pickle_env(shared_env: gym.Env):
+    env = shared_env
     pickled_env: gym.Env = pickle.loads(pickle.dumps(env))
 
-    data_equivalence(env.reset(), pickled_env.reset())
+    # The pickled environment is made from the arguments of the environment, therefore, their
+    # states are compared after a reset with the same seed from the same MuJoCo state, as the reset
+    # of some environments depends on the previous steps (see `test_env_determinism_rollout`)
+    set_state(
+        pickled_env,
+        get_state(env, mujoco.mjtState.mjSTATE_INTEGRATION),
+        mujoco.mjtState.mjSTATE_INTEGRATION,
+    )
+    env.reset(seed=SEED)
+    pickled_env.reset(seed=SEED)
+    assert np.array_equal(env.unwrapped.data.qpos, pickled_env.unwrapped.data.qpos)
+    assert np.array_equal(env.unwrapped.data.qvel, pickled_env.unwrapped.data.qvel)
 
     action = env.action_space.sample()
-    data_equivalence(env.step(action), pickled_env.step(action))
-    env.close()
+    env.step(action)
+    pickled_env.step(action)
+    assert np.array_equal(env.unwrapped.data.qpos, pickled_env.unwrapped.data.qpos)
+    assert np.array_equal(env.unwrapped.data.qvel, pickled_env.unwrapped.data.qvel)
     pickled_env.close()
 
 
+# The expected `pytest-xdist` group of the tests of an environment (see `tests/conftest.py`)
+_test_xdist_group_expected = {
+    "FetchReach-v4": "FetchReach-v4",
+    "AntMaze_UMaze-v3": "AntMaze-v3",
+}
+
+
+@pytest.mark.parametrize("shared_env", list(_test_xdist_group_expected), indirect=True)
+def test_xdist_group(shared_env: gym.Env, request):
+    """Check that the tests of an environment are grouped for `pytest-xdist` with `--dist=loadgroup`."""
+    if not hasattr(request.config, "workerinput"):
+        pytest.skip("not running in a pytest-xdist worker")
+    if not request.config.getvalue("loadgroup"):
+        pytest.skip("not running with --dist=loadgroup")
+
+    expected_group = _test_xdist_group_expected[shared_env.spec.id]
+    assert request.node.nodeid.endswith(
+        f"@{expected_group}"
+    ), f"{request.node.nodeid} is not in the xdist group {expected_group}"
+
+
 _test_robot_env_reset_list = ["Fetch", "HandReach"]
+_test_robot_env_reset_ids = [
+    env_id
+    for env_id in non_mujoco_py_env_ids
+    if any(tar in env_id for tar in _test_robot_env_reset_list)
+]
+# Whether the object location has to be excluded from the initial state of the environment
+_test_robot_env_reset_has_object = {
+    env_id: any(
+        tar in env_id for tar in ["FetchPush", "FetchPickAndPlace", "FetchSlide"]
+    )
+    for env_id in _test_robot_env_reset_ids
+}
 
 
-@pytest.mark.parametrize(
-    "spec",
-    [
-        spec
-        for spec in non_mujoco_py_env_specs
-        if np.any([tar in spec.id for tar in _test_robot_env_reset_list])
-    ],
-    ids=[
-        spec.id
-        for spec in non_mujoco_py_env_specs
-        if np.any([tar in spec.id for tar in _test_robot_env_reset_list])
-    ],
-)
-def test_robot_env_reset(spec):
+@pytest.mark.parametrize("shared_env", _test_robot_env_reset_ids, indirect=True)
+def test_robot_env_reset(shared_env: gym.Env):
     """Check initial state of robotic environment, i.e. Fetch and Shadow Dexterous Hand Reach,
     whether their initial states match the description in the documentation."""
 
@@ -207,25 +252,18 @@ def test_robot_env_reset(spec):
         )
 
         # exclude object location from environments
-        if np.any(
-            [
-                tar in spec.id
-                for tar in [
-                    "FetchPush",
-                    "FetchPickAndPlace",
-                    "FetchSlide",
-                ]
-            ]
-        ):
-            diag_dict["qpos"] = np.delete(diag_dict["qpos"], np.s_[-7:-5])
-            diag_dict["init_qpos"] = np.delete(diag_dict["init_qpos"], np.s_[-7:-5])
+        if _test_robot_env_reset_has_object[env.spec.id]:
+            diag_dict["qpos"] = np.concatenate(
+                [diag_dict["qpos"][:-7], diag_dict["qpos"][-5:]]
+            )
+            diag_dict["init_qpos"] = np.concatenate(
+                [diag_dict["init_qpos"][:-7], diag_dict["init_qpos"][-5:]]
+            )
 
         # testing
-        assert np.all(diag_dict["qpos"] == diag_dict["init_qpos"])
-        assert np.all(diag_dict["qvel"] == diag_dict["init_qvel"])
+        assert np.array_equal(diag_dict["qpos"], diag_dict["init_qpos"])
+        assert np.array_equal(diag_dict["qvel"], diag_dict["init_qvel"])
         return diag_dict
 
-    cur_env: gym.Env = spec.make()
-
-    _test_initial_states(cur_env, seed=24)
-    _test_initial_states(cur_env, seed=10)
+    _test_initial_states(shared_env, seed=24)
+    _test_initial_states(shared_env, seed=10)
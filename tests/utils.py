@@ -9,6 +9,17 @@ for env_spec in gym.registry.values():
         if env_spec.entry_point.startswith("gymnasium_robotics.envs"):
             all_testing_env_specs.append(env_spec)
 
+# Exclude mujoco_py environments in test_render_modes test due to OpenGL error.
+non_mujoco_py_env_specs = [
+    spec
+    for spec in all_testing_env_specs
+    if "MujocoPy" not in spec.entry_point
+    and not spec.entry_point.startswith(
+        "gymnasium_robotics.envs.mujoco."
+    )  # Exclude version 2 and version 3 of the "mujoco" environments
+]
+non_mujoco_py_env_ids = [spec.id for spec in non_mujoco_py_env_specs]
+
 
 def assert_equals(a, b, prefix=None):
     """Assert equality of data structures `a` and `b`.
@@ -25,11 +36,12 @@ def assert_equals(a, b, prefix=None):
         for k in a.keys():
             v_a = a[k]
             v_b = b[k]
-            assert_equals(v_a, v_b)
+            assert_equals(v_a, v_b, prefix)
     elif isinstance(a, np.ndarray):
-        np.testing.assert_array_equal(a, b)
+        np.testing.assert_array_equal(a, b, err_msg=prefix or "")
     elif isinstance(a, tuple):
+        assert len(a) == len(b), f"{prefix}Differing lengths: {a} and {b}"
         for elem_from_a, elem_from_b in zip(a, b):
-            assert_equals(elem_from_a, elem_from_b)
+            assert_equals(elem_from_a, elem_from_b, prefix)
     else:
         assert a == b